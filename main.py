@@ -1,23 +1,31 @@
 import asyncio
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 import re
 import random
-import json
 import pickle
 import gzip
-from typing import Dict, Any, Optional, List
-from datetime import datetime, timedelta
+import hashlib
+import heapq
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
+from typing import Callable, Dict, Any, Literal, Optional, List, Set, Tuple, Union
+from datetime import datetime
 from dataclasses import asdict
 from contextlib import asynccontextmanager
 from functools import wraps
 
 import httpx
+import orjson
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field, validator
-from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from pydantic import BaseModel, Field, computed_field, validator
+from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -34,26 +42,69 @@ except ImportError:
     REDIS_AVAILABLE = False
     logging.warning("Redis not available, using in-memory fallback")
 
+# Prometheus импорты
+try:
+    from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    logging.warning("prometheus_client not available, /metrics disabled")
+
 # --- НАСТРОЙКА ---
 load_dotenv()
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+# Запись в stdout идет в отдельном потоке, обработчики в event loop только кладут записи в очередь
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler(sys.stdout)
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler], force=True)
 logger = logging.getLogger("roleverse")
 
 # Конфигурация
 WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
 WEBAPP_PORT = int(os.getenv("PORT", 8000))
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_RPM = int(os.getenv("DEEPSEEK_RPM", 600))  # Запросов в минуту
+DEEPSEEK_TPM = int(os.getenv("DEEPSEEK_TPM", 1_000_000))  # Токенов в минуту
+DEEPSEEK_MAX_CONCURRENT = int(os.getenv("DEEPSEEK_MAX_CONCURRENT", 10))
+DEEPSEEK_RETRIES = 3
+DEEPSEEK_TIMEOUT = int(os.getenv("DEEPSEEK_TIMEOUT", 30))  # Общий срок одного запроса, секунд
+JUDGE_MAX_TOKENS = 150  # JSON-вердикт с причиной отказа в 1-2 предложения
+SUMMARY_MAX_TOKENS = 400
 REDIS_URL = os.getenv("REDIS_URL")
-if not REDIS_URL or not REDIS_URL.startswith("redis://"):
+if not REDIS_URL or not REDIS_URL.startswith(("redis://", "rediss://", "unix://")):
     logger.warning("Redis URL not properly configured, using in-memory fallback")
     REDIS_AVAILABLE = False
 else:
     REDIS_AVAILABLE = True
-REDIS_TTL = int(os.getenv("REDIS_TTL", 3600))  # 1 час
+REDIS_TTL = int(os.getenv("REDIS_TTL", 86400))  # 24 часа, как и cleanup_expired
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 256))  # Сессий в памяти при работающем Redis
+MAX_HISTORY_MESSAGES = 12  # Предел истории в сессии (вся она уходит в запрос к ИИ)
+PROMPT_HISTORY_MESSAGES = 6  # Сколько последних сообщений остается после обрезки
+CHARACTER_QUEUE_SIZE = int(os.getenv("CHARACTER_QUEUE_SIZE", 1000))
+CHARACTER_WORKERS = int(os.getenv("CHARACTER_WORKERS", 8))
+# Страницы рендерятся один раз; при разработке шаблонов выключите CACHE_TEMPLATES=false
+CACHE_TEMPLATES = os.getenv("CACHE_TEMPLATES", "true").lower() == "true"
+DEFAULT_DIFFICULTY = 5  # Сложность действия по шкале 1-10, если ИИ ее не оценивал
+
+# Метрики использования DeepSeek
+if PROMETHEUS_AVAILABLE:
+    DEEPSEEK_PROMPT_TOKENS = Counter(
+        "deepseek_prompt_tokens", "Prompt tokens sent to DeepSeek", ["cache"]
+    )
+    DEEPSEEK_COMPLETION_TOKENS = Counter(
+        "deepseek_completion_tokens", "Completion tokens generated by DeepSeek"
+    )
+    DEEPSEEK_STREAM_EARLY_STOPS = Counter(
+        "deepseek_stream_early_stops", "Streamed DeepSeek responses closed early, without usage"
+    )
+
+# Генератор бросков кубиков
+dice = random.Random()
 
 # Rate limiter
 limiter = Limiter(key_func=get_remote_address)
@@ -61,14 +112,18 @@ limiter = Limiter(key_func=get_remote_address)
 
 # --- МОДЕЛИ ДАННЫХ ---
 
+# Опасные символы в названиях предметов
+_UNSAFE_ITEM_CHARS_RE = re.compile(r"[<>{};]")
+
+
 class SaveData(BaseModel):
     """Валидированные данные сохранения"""
     user_id: str
     character: Optional[str] = None
-    inventory: List[str] = []
+    inventory: List[str] = Field(default_factory=list)
     health: int = Field(default=100, ge=0, le=100)
-    stats: Dict[str, int] = {}
-    abilities: Dict[str, bool] = {}
+    stats: Dict[str, int] = Field(default_factory=dict)
+    abilities: Dict[str, bool] = Field(default_factory=dict)
     world_context: str = ""
     game_over: bool = False
     last_active: str = Field(default_factory=lambda: datetime.now().isoformat())
@@ -87,53 +142,133 @@ class SaveData(BaseModel):
             if len(item) > 100:
                 raise ValueError("Item name too long")
             # Убираем опасные символы
-            cleaned.append(re.sub(r'[<>{};]', '', item)[:50])
+            cleaned.append(_UNSAFE_ITEM_CHARS_RE.sub('', item)[:50])
         return cleaned
 
 
+# Поля сессии, попадающие в сохранение
+_SAVE_FIELDS = frozenset(SaveData.model_fields)
+
+
 class UserSession(BaseModel):
     """Игровая сессия"""
     user_id: str
     character: Optional[str] = None
-    inventory: List[str] = []
+    inventory: List[str] = Field(default_factory=list)
     health: int = 100
-    stats: Dict[str, int] = {}
-    abilities: Dict[str, bool] = {}
-    messages: List[Dict[str, str]] = []
+    stats: Dict[str, int] = Field(default_factory=dict)
+    abilities: Dict[str, bool] = Field(default_factory=dict)
+    messages: List[Dict[str, str]] = Field(default_factory=list)
     world_context: str = ""
     universe: Optional[str] = None
     ruleset: Optional[str] = None
     game_over: bool = False
     created_at: datetime = Field(default_factory=datetime.now)
-    last_active: datetime = Field(default_factory=datetime.now)
+    # Время активности хранится числом: обновляется на каждый ход
+    last_active_ts: float = Field(default_factory=time.time)
+
+    @computed_field
+    @property
+    def last_active(self) -> datetime:
+        """Время последней активности для сохранений и вывода"""
+        return datetime.fromtimestamp(self.last_active_ts)
 
     def to_save_data(self) -> SaveData:
         """Конвертирует сессию в SaveData"""
-        return SaveData(
-            user_id=self.user_id,
-            character=self.character,
-            inventory=self.inventory,
-            health=self.health,
-            stats=self.stats,
-            abilities=self.abilities,
-            world_context=self.world_context,
-            game_over=self.game_over,
-            last_active=self.last_active.isoformat()
-        )
+        # Инвентарь и характеристики приходят из ответов ИИ - валидаторы их очищают
+        return SaveData.model_validate(self.model_dump(mode="json", include=_SAVE_FIELDS))
 
     def update_activity(self):
         """Обновляет время последней активности"""
-        self.last_active = datetime.now()
+        self.last_active_ts = time.time()
+
+
+class ActionResponse(BaseModel):
+    """Результат успешного действия"""
+    success: bool = True
+    action_result: str
+    chance: float
+    rolled: float
+    outcome: str
+    inventory: List[str]
+    health: int
+    type: str = "action_result"
+
+
+class ActionRejectedResponse(BaseModel):
+    """Действие отклонено проверкой"""
+    success: bool = False
+    message: str
+    action_result: str
+    type: Literal["validation_error"] = "validation_error"
+
+
+class GameOverResponse(BaseModel):
+    """Игра уже окончена"""
+    success: bool = False
+    message: str = "Игра окончена. Начните новую игру."
+    game_over: Literal[True]
+
+
+class SaveGameResponse(BaseModel):
+    """Ответ на сохранение игры"""
+    success: bool = True
+    save_data: SaveData
+    message: str = "Игра сохранена"
+
+
+class GameData(BaseModel):
+    """Состояние персонажа после загрузки"""
+    inventory: List[str]
+    stats: Dict[str, int]
+    abilities: List[str]
+    health: int
+    character: Optional[str] = None
+
+
+class LoadGameResponse(BaseModel):
+    """Ответ на загрузку игры"""
+    success: bool = True
+    message: str = "Игра загружена"
+    game_data: GameData
+
+
+# Формат сессии в Redis: JSON как есть (старые записи и короткие сессии)
+# или байт версии + gzip от JSON для длинных историй
+_SESSION_GZIP_TAG = b"\x01"
+_SESSION_COMPRESS_MIN = 1024
+
+
+def pack_session(session: UserSession) -> bytes:
+    """Сериализация сессии для Redis, длинные сессии сжимаются"""
+    data = session.model_dump_json().encode()
+    if len(data) < _SESSION_COMPRESS_MIN:
+        return data
+    return _SESSION_GZIP_TAG + gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def unpack_session(data: bytes) -> UserSession:
+    """Разбор сессии из Redis с учетом байта версии"""
+    if data[:1] == _SESSION_GZIP_TAG:
+        data = gzip.decompress(data[1:])
+    return UserSession.model_validate_json(data)
 
 
 class SessionStore:
     """Унифицированное хранилище сессий"""
 
-    def __init__(self):
+    def __init__(self, backup_file: str = "data/sessions_backup.json"):
         self.redis_client = None
-        self.in_memory_store: Dict[str, UserSession] = {}
-        self.backup_file = "data/sessions_backup.json"
-        self._httpx_client = None
+        # Без Redis - основное хранилище; с Redis - запасная копия недавних сессий на случай сбоя Redis
+        self.in_memory_store: OrderedDict[str, UserSession] = OrderedDict()
+        # Сессии, которые не удалось записать в Redis: живут только в памяти и в резервной копии
+        self._unsynced: Set[str] = set()
+        self.backup_file = backup_file
+        # Изменения копятся и пишутся на диск фоновой задачей backup_loop
+        self._backup_dirty = asyncio.Event()
+        # Куча (last_active_ts, user_id) для очистки без обхода всех сессий;
+        # устаревшие записи не удаляются сразу, а пропускаются при извлечении
+        self._expiry_heap: List[Tuple[float, str]] = []
 
         # Инициализация Redis
         if REDIS_AVAILABLE:
@@ -147,8 +282,8 @@ class SessionStore:
         try:
             self.redis_client = redis.from_url(
                 REDIS_URL,
-                encoding="utf-8",
-                decode_responses=True,
+                # Сессии хранятся байтами и разбираются pydantic напрямую
+                decode_responses=False,
                 socket_timeout=5,
                 socket_connect_timeout=5
             )
@@ -161,78 +296,133 @@ class SessionStore:
         """Загрузка резервной копии из файла"""
         try:
             if os.path.exists(self.backup_file):
-                with open(self.backup_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                with open(self.backup_file, 'rb') as f:
+                    data = orjson.loads(f.read())
                     for user_id, session_data in data.items():
-                        # Конвертируем строки datetime обратно
-                        if 'created_at' in session_data:
-                            session_data['created_at'] = datetime.fromisoformat(session_data['created_at'])
-                        if 'last_active' in session_data:
-                            session_data['last_active'] = datetime.fromisoformat(session_data['last_active'])
-                        self.in_memory_store[user_id] = UserSession(**session_data)
+                        # Старые копии хранили время активности строкой
+                        if 'last_active' in session_data and 'last_active_ts' not in session_data:
+                            session_data['last_active_ts'] = datetime.fromisoformat(session_data['last_active']).timestamp()
+                        self.in_memory_store[user_id] = UserSession.model_validate(session_data)
+                if self.redis_client:
+                    # Неизвестно, есть ли эти сессии в Redis - держим их до первой записи
+                    self._unsynced.update(self.in_memory_store)
+                self._rebuild_expiry_heap()
                 logger.info(f"Loaded backup: {len(self.in_memory_store)} sessions")
         except Exception as e:
             logger.error(f"Failed to load backup: {e}")
 
-    def _save_backup(self):
-        """Сохранение резервной копии в файл"""
-        try:
-            os.makedirs('data', exist_ok=True)
-            backup_data = {}
-            for user_id, session in self.in_memory_store.items():
-                backup_data[user_id] = json.loads(session.json())
+    def _dump_backup(self) -> bytes:
+        """Сериализация всех сессий (в потоке event loop, пока их никто не меняет)"""
+        # С Redis на диск нужны только сессии, которых в нем нет;
+        # JSON каждой сессии собирает pydantic, без промежуточных словарей
+        user_ids = self._unsynced if self.redis_client else self.in_memory_store
+        parts = [
+            orjson.dumps(user_id) + b":" + self.in_memory_store[user_id].model_dump_json().encode()
+            for user_id in user_ids
+        ]
+        return b"{" + b",".join(parts) + b"}"
+
+    def _write_backup(self, content: bytes):
+        """Атомарная запись резервной копии в файл"""
+        os.makedirs(os.path.dirname(self.backup_file) or '.', exist_ok=True)
+        tmp_file = f"{self.backup_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_file, self.backup_file)
+
+    def _rebuild_expiry_heap(self):
+        """Пересборка кучи сроков из текущих сессий"""
+        self._expiry_heap = [
+            (session.last_active_ts, user_id)
+            for user_id, session in self.in_memory_store.items()
+        ]
+        heapq.heapify(self._expiry_heap)
 
-            with open(self.backup_file, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, ensure_ascii=False, indent=2)
+    def _trim_cache(self):
+        """Вытесняет давно не использованные сессии, уже сохраненные в Redis"""
+        excess = len(self.in_memory_store) - len(self._unsynced) - SESSION_CACHE_SIZE
+        if not self.redis_client or excess <= 0:
+            return
+        stale = (user_id for user_id in self.in_memory_store if user_id not in self._unsynced)
+        for user_id in list(islice(stale, excess)):
+            del self.in_memory_store[user_id]
+
+    def _mark_dirty(self):
+        """Помечает резервную копию устаревшей"""
+        self._backup_dirty.set()
+
+    async def flush_backup(self):
+        """Сохранение резервной копии; запись на диск идет в отдельном потоке"""
+        self._backup_dirty.clear()
+        try:
+            await asyncio.to_thread(self._write_backup, self._dump_backup())
         except Exception as e:
             logger.error(f"Failed to save backup: {e}")
 
-    @property
-    def httpx_client(self):
-        """Ленивая инициализация httpx клиента с пулом соединений"""
-        if self._httpx_client is None:
-            limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
-            timeout = httpx.Timeout(30.0, connect=5.0)
-            self._httpx_client = httpx.AsyncClient(
-                limits=limits,
-                timeout=timeout,
-                http2=True
-            )
-        return self._httpx_client
+    async def backup_loop(self, delay: float = 2.0):
+        """Фоновая запись резервной копии: изменения за delay секунд сливаются в одну запись"""
+        while True:
+            await self._backup_dirty.wait()
+            await asyncio.sleep(delay)
+            await self.flush_backup()
 
     async def get(self, user_id: str) -> Optional[UserSession]:
         """Получение сессии"""
-        # Сначала пробуем Redis
-        if self.redis_client:
+        # Redis - источник истины: его же читают другие воркеры. Память нужна,
+        # только если Redis недоступен или последняя запись в него не прошла
+        if self.redis_client and user_id not in self._unsynced:
             try:
                 data = await self.redis_client.get(f"session:{user_id}")
-                if data:
-                    session_data = json.loads(data)
-                    return UserSession(**session_data)
             except Exception as e:
                 logger.error(f"Redis get error: {e}")
-
-        # Fallback на память
-        return self.in_memory_store.get(user_id)
+            else:
+                if not data:
+                    # Сессия истекла или удалена в другом воркере
+                    self.in_memory_store.pop(user_id, None)
+                    return None
+                session = unpack_session(data)
+                self.in_memory_store[user_id] = session
+                self.in_memory_store.move_to_end(user_id)
+                self._trim_cache()
+                return session
+
+        session = self.in_memory_store.get(user_id)
+        if session is not None:
+            self.in_memory_store.move_to_end(user_id)
+        return session
 
     async def set(self, user_id: str, session: UserSession):
         """Сохранение сессии"""
-        session_data = session.json()
-
         # Сохраняем в Redis
+        stored = False
         if self.redis_client:
             try:
                 await self.redis_client.setex(
                     f"session:{user_id}",
                     REDIS_TTL,
-                    session_data
+                    pack_session(session)
                 )
+                stored = True
             except Exception as e:
                 logger.error(f"Redis set error: {e}")
 
-        # И в память
+        # И в память: как кэш, если Redis принял запись, иначе как основное хранилище
         self.in_memory_store[user_id] = session
-        self._save_backup()
+        self.in_memory_store.move_to_end(user_id)
+        heapq.heappush(self._expiry_heap, (session.last_active_ts, user_id))
+        # Не даем куче разрастись из-за устаревших записей активных игроков
+        if len(self._expiry_heap) > 4 * len(self.in_memory_store) + 1024:
+            self._rebuild_expiry_heap()
+
+        if stored:
+            if user_id in self._unsynced:
+                self._unsynced.discard(user_id)
+                self._mark_dirty()
+            self._trim_cache()
+        else:
+            if self.redis_client:
+                self._unsynced.add(user_id)
+            self._mark_dirty()
 
     async def delete(self, user_id: str):
         """Удаление сессии"""
@@ -244,21 +434,77 @@ class SessionStore:
 
         if user_id in self.in_memory_store:
             del self.in_memory_store[user_id]
-            self._save_backup()
+            if not self.redis_client or user_id in self._unsynced:
+                self._unsynced.discard(user_id)
+                self._mark_dirty()
+
+    def _evict_local(self, user_id: str):
+        """Удаление сессии только из памяти; резервная копия нужна лишь для незаписанных в Redis"""
+        self.in_memory_store.pop(user_id, None)
+        if user_id in self._unsynced:
+            self._unsynced.discard(user_id)
+            self._mark_dirty()
+
+    async def clear(self, batch: int = 500) -> int:
+        """Удаление всех сессий; возвращает число удаленных сессий"""
+        count = len(self.in_memory_store)
+        self.in_memory_store.clear()
+        self._unsynced.clear()
+        self._expiry_heap.clear()
+        self._mark_dirty()
 
-    async def cleanup_expired(self, hours: int = 24):
-        """Очистка устаревших сессий"""
-        cutoff = datetime.now() - timedelta(hours=hours)
-        expired = []
+        if self.redis_client:
+            # SCAN не блокирует Redis как KEYS, UNLINK освобождает память в фоне
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                queued = removed = 0
+                async for key in self.redis_client.scan_iter(match="session:*", count=batch):
+                    pipe.unlink(key)
+                    queued += 1
+                    removed += 1
+                    if queued >= batch:
+                        await pipe.execute()
+                        queued = 0
+                if queued:
+                    await pipe.execute()
+                count = max(count, removed)
+            except Exception as e:
+                logger.error(f"Failed to clear Redis: {e}")
+
+        return count
+
+    async def cleanup_expired(self, hours: int = 24) -> int:
+        """Очистка устаревших сессий; возвращает число удаленных"""
+        cutoff = time.time() - hours * 3600
+        # В куче может быть несколько устаревших записей одного игрока
+        expired: Set[str] = set()
+        refreshed = []
+
+        # Извлекаем только записи старше cutoff, а не обходим все сессии
+        while self._expiry_heap and self._expiry_heap[0][0] < cutoff:
+            _, user_id = heapq.heappop(self._expiry_heap)
+            session = self.in_memory_store.get(user_id)
+            if session is None:
+                continue
+            if session.last_active_ts < cutoff:
+                expired.add(user_id)
+            else:
+                # Активность обновилась без повторного set - возвращаем с новым сроком
+                refreshed.append((session.last_active_ts, user_id))
 
-        for user_id, session in self.in_memory_store.items():
-            if session.last_active < cutoff:
-                expired.append(user_id)
+        for entry in refreshed:
+            heapq.heappush(self._expiry_heap, entry)
 
         for user_id in expired:
-            await self.delete(user_id)
+            if self.redis_client:
+                # Копия в памяти могла устареть: другой воркер мог обновить сессию.
+                # Ключи Redis истекают сами по TTL из setex, удаляем только локальное
+                self._evict_local(user_id)
+            else:
+                await self.delete(user_id)
 
         logger.info(f"Cleaned up {len(expired)} expired sessions")
+        return len(expired)
 
 
 # Инициализация хранилища
@@ -268,73 +514,164 @@ session_store = SessionStore()
 # --- КЭШ ИИ-ОТВЕТОВ ---
 
 class AICache:
-    """Кэш для ИИ-ответов"""
-
-    def __init__(self):
-        self.cache: Dict[str, tuple[str, datetime]] = {}
-        self.ttl = 300  # 5 минут
-
-    def _get_key(self, messages: List[Dict]) -> str:
-        """Генерация ключа кэша"""
-        import hashlib
-        content = json.dumps(messages, sort_keys=True)
-        return hashlib.md5(content.encode()).hexdigest()
-
-    async def get(self, messages: List[Dict]) -> Optional[str]:
+    """LRU-кэш для детерминированных ИИ-ответов"""
+
+    # Кэшируем только низкотемпературные вызовы (валидация и т.п.)
+    MAX_TEMPERATURE = 0.3
+
+    def __init__(self, max_size: int = 2048, ttl: int = 300):
+        # Значение - ответ и момент истечения по time.monotonic()
+        self.cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl  # 5 минут
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, messages: List[Dict], temperature: float, max_tokens: int) -> Optional[str]:
+        """BLAKE2b ключ кэша. Для недетерминированных вызовов возвращает None"""
+        if temperature > self.MAX_TEMPERATURE:
+            return None
+        # Хэшируем поля напрямую, без промежуточной сериализации в JSON
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{DEEPSEEK_MODEL}\0{temperature}\0{max_tokens}".encode())
+        for message in messages:
+            digest.update(f"\0{message['role']}\0{message['content']}".encode())
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
         """Получение из кэша"""
-        key = self._get_key(messages)
-        if key in self.cache:
-            response, timestamp = self.cache[key]
-            if (datetime.now() - timestamp).seconds < self.ttl:
-                logger.debug(f"Cache hit for key: {key[:8]}")
+        entry = self.cache.get(key)
+        if entry:
+            response, expires_at = entry
+            if time.monotonic() < expires_at:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                logger.debug("Cache hit for key: %s", key[:8])
                 return response
-            else:
-                del self.cache[key]
+            del self.cache[key]
+        self.misses += 1
         return None
 
-    async def set(self, messages: List[Dict], response: str):
+    async def set(self, key: str, response: str):
         """Сохранение в кэш"""
-        key = self._get_key(messages)
-        self.cache[key] = (response, datetime.now())
-        logger.debug(f"Cache set for key: {key[:8]}")
+        self.cache[key] = (response, time.monotonic() + self.ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        logger.debug("Cache set for key: %s", key[:8])
+
+    def sweep_expired(self) -> int:
+        """Удаляет истекшие записи, к которым больше не обращались"""
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self.cache.items() if expires_at <= now]
+        for key in expired:
+            del self.cache[key]
+        return len(expired)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Статистика кэша"""
+        return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
 
 
 ai_cache = AICache()
 
+# --- ОГРАНИЧЕНИЕ ЗАПРОСОВ К ИИ ---
+
+class TokenBucket:
+    """Token bucket для соблюдения лимитов RPM/TPM"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.request_rate = rpm / 60
+        self.token_rate = tpm / 60
+        self.request_capacity = rpm
+        self.token_capacity = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        """Пополнение корзины за прошедшее время"""
+        now = time.monotonic()
+        elapsed = now - self.last
+        self.last = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    async def acquire(self, est_tokens: int):
+        """Ожидает, пока в корзине хватит запросов и токенов"""
+        est_tokens = min(est_tokens, self.token_capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= est_tokens:
+                    self.requests -= 1
+                    self.tokens -= est_tokens
+                    return
+                wait_time = max(
+                    (1 - self.requests) / self.request_rate,
+                    (est_tokens - self.tokens) / self.token_rate
+                )
+                await asyncio.sleep(wait_time)
+
+
+deepseek_bucket = TokenBucket(DEEPSEEK_RPM, DEEPSEEK_TPM)
+deepseek_semaphore = asyncio.Semaphore(DEEPSEEK_MAX_CONCURRENT)
+
+# Очередь фонового создания персонажей: ограничивает число одновременных
+# запросов к ИИ и память под ожидающие задачи
+character_queue: asyncio.Queue = asyncio.Queue(maxsize=CHARACTER_QUEUE_SIZE)
+
 
 # --- FASTAPI ПРИЛОЖЕНИЕ ---
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Контекстный менеджер для управления жизненным циклом"""
+    log_listener.start()
     logger.info("RoleVerse starting up...")
 
-    # Запускаем задачу очистки
+    # Общий клиент DeepSeek: пул соединений и keep-alive на все время работы
+    app.state.deepseek = create_deepseek_client()
+
+    # Запускаем задачи очистки и обработчики очереди персонажей
     cleanup_task = asyncio.create_task(periodic_cleanup())
+    sweep_task = asyncio.create_task(periodic_cache_sweep())
+    backup_task = asyncio.create_task(session_store.backup_loop())
+    character_workers = [asyncio.create_task(character_worker()) for _ in range(CHARACTER_WORKERS)]
 
     yield
 
-    # Останавливаем задачи
-    cleanup_task.cancel()
+    # Дожидаемся уже принятых задач создания персонажей
     try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+        await asyncio.wait_for(character_queue.join(), timeout=30)
+    except asyncio.TimeoutError:
+        logger.warning(f"Character queue not drained: {character_queue.qsize()} tasks left")
+
+    # Останавливаем задачи
+    for task in [cleanup_task, sweep_task, backup_task, *character_workers]:
+        task.cancel()
+    await asyncio.gather(cleanup_task, sweep_task, backup_task, *character_workers, return_exceptions=True)
+
+    # Последние изменения, еще не попавшие в резервную копию
+    await session_store.flush_backup()
 
     # Закрываем клиенты
-    if session_store._httpx_client:
-        await session_store._httpx_client.aclose()
+    await app.state.deepseek.aclose()
 
     if session_store.redis_client:
         await session_store.redis_client.close()
 
     logger.info("RoleVerse shutting down...")
+    log_listener.stop()
 
 
 app = FastAPI(
     title="RoleVerse - AI RPG Game",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Middleware
@@ -353,6 +690,71 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 # Статические файлы и шаблоны
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+_rendered_pages: Dict[str, str] = {}
+
+
+def render_page(name: str, request: Request) -> HTMLResponse:
+    """Шаблоны страниц не зависят от запроса, поэтому готовый HTML переиспользуется"""
+    if not CACHE_TEMPLATES:
+        return templates.TemplateResponse(name, {"request": request})
+
+    html = _rendered_pages.get(name)
+    if html is None:
+        html = _rendered_pages[name] = templates.get_template(name).render(request=request)
+    return HTMLResponse(html)
+
+
+# --- ВСЕЛЕННЫЕ ---
+
+UNIVERSES = (
+    {"id": "fantasy", "name": "🧙 Фэнтези", "description": "Мир магии и драконов"},
+    {"id": "cyberpunk", "name": "🚀 Киберпанк", "description": "Технологии и корпорации"},
+    {"id": "space", "name": "🪐 Космоопера", "description": "Межзвездные путешествия"},
+    {"id": "custom", "name": "🎨 Своя вселенная", "description": "Создайте свой мир"}
+)
+
+# Правила готовых вселенных; для своей вселенной правила задает игрок
+UNIVERSE_RULES = {
+    "fantasy": "Классическое фэнтези с магами, драконами и древними артефактами. Магия управляется мантрой и жезлами.",
+    "cyberpunk": "Мир недалекого будущего, где технологии правят миром, кибернетические импланты - обыденность.",
+    "space": "Эпоха межзвездных путешествий, инопланетных цивилизаций и космических битв.",
+}
+CUSTOM_UNIVERSE_RULES = "Вы сами определяете законы мира."
+
+
+# --- ПРОМПТЫ ИИ ---
+# Статичные инструкции идут system-сообщением в начале запроса, а переменная
+# часть - в конце user-сообщения: одинаковый префикс попадает в кэш DeepSeek.
+
+GAMEMASTER_SYS = (
+    "Ты - Мастер Игры. Создай начало истории по правилам мира и желанию игрока.\n\n"
+    "ЗАДАНИЕ:\n"
+    "1. Создай краткое, но атмосферное описание персонажа и стартовой локации (3-4 абзаца).\n"
+    "2. Опиши событие, с которого начинается игра.\n"
+    "3. Используй **жирный текст** для важных моментов и *курсив* для атмосферы.\n"
+    "4. В конце добавь строки:\n"
+    "INVENTORY_ADD: предмет1, предмет2, предмет3\n"
+    "CHARACTER_DATA: {\"stats\": {\"Сила\": 8, \"Ловкость\": 7, \"Интеллект\": 6, \"Мудрость\": 5, \"Харизма\": 4}, \"abilities\": {\"Паркур\": true, \"Скрытность\": true}}"
+)
+
+STORY_SYS = (
+    "Ты - Мастер Игры в текстовой ролевой игре. "
+    "Описывай исходы действий игрока, сохраняя последовательность истории."
+)
+
+VALIDATE_SYS = (
+    "Ты - Мастер Игры. Игрок пытается совершить действие в текущем контексте мира.\n\n"
+    "Оцени действие и верни ТОЛЬКО JSON:\n"
+    '{"valid": true или false, '
+    '"reason": "если действие невозможно или нелогично - объяснение для игрока в короткой повествовательной форме (1-2 предложения)", '
+    '"difficulty": сложность от 1 до 10}'
+)
+
+SUMMARY_SYS = (
+    "Ты - летописец текстовой ролевой игры. Объедини предысторию и новые события в один краткий пересказ "
+    "(не более 5 предложений). Сохрани важное: где находится герой, с кем он встретился, "
+    "что узнал и что изменилось в мире."
+)
 
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
@@ -369,87 +771,458 @@ async def periodic_cleanup():
             logger.error(f"Cleanup error: {e}")
 
 
-async def get_ai_response(messages: List[Dict], temperature: float = 0.7) -> str:
+async def periodic_cache_sweep():
+    """Периодическая очистка истекших ИИ-ответов"""
+    while True:
+        try:
+            await asyncio.sleep(60)
+            expired = ai_cache.sweep_expired()
+            if expired:
+                logger.debug("Swept %d expired AI cache entries", expired)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Cache sweep error: {e}")
+
+
+async def character_worker():
+    """Обработчик очереди создания персонажей"""
+    while True:
+        user_id, messages, character_prompt = await character_queue.get()
+        try:
+            await update_session_character(user_id, messages, character_prompt)
+        finally:
+            character_queue.task_done()
+
+
+def create_deepseek_client() -> httpx.AsyncClient:
+    """Клиент DeepSeek API с пулом соединений"""
+    return httpx.AsyncClient(
+        base_url="https://api.deepseek.com",
+        headers={
+            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=50, keepalive_expiry=60),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        http2=True
+    )
+
+
+async def read_json(request: Request) -> Dict:
+    """Разбирает тело запроса через orjson"""
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Некорректный JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Ожидался JSON-объект")
+    return data
+
+
+def estimate_tokens(payload: Dict) -> int:
+    """Грубая оценка: ~2 символа на токен плюс бюджет ответа"""
+    return sum(len(m["content"]) for m in payload["messages"]) // 2 + payload["max_tokens"]
+
+
+# Сбои соединения, после которых запрос можно повторить; зависший ответ
+# не повторяем - пользователь и так ждал DEEPSEEK_TIMEOUT
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.WriteError,
+                     httpx.RemoteProtocolError)
+
+
+async def post_chat_completion(client: httpx.AsyncClient, payload: Dict) -> httpx.Response:
+    """POST к DeepSeek с учетом лимитов и повтором при 429/5xx"""
+    est_tokens = estimate_tokens(payload)
+    delay = 1.0
+
+    for attempt in range(DEEPSEEK_RETRIES + 1):
+        last_attempt = attempt == DEEPSEEK_RETRIES
+        await deepseek_bucket.acquire(est_tokens)
+        try:
+            async with deepseek_semaphore:
+                response = await asyncio.wait_for(
+                    client.post("/chat/completions", json=payload), timeout=DEEPSEEK_TIMEOUT
+                )
+        except _RETRYABLE_ERRORS as e:
+            if last_attempt:
+                raise
+            logger.warning(f"DeepSeek API connection failed ({type(e).__name__}), retrying in {delay:.0f}s")
+        else:
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or last_attempt:
+                return response
+            logger.warning(f"DeepSeek API returned {response.status_code}, retrying in {delay:.0f}s")
+
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+def record_usage(usage: Dict[str, Any]):
+    """Учет токенов запроса: лог доли попаданий в префиксный кэш DeepSeek и метрики"""
+    cache_hit = usage.get("prompt_cache_hit_tokens", 0)
+    cache_miss = usage.get("prompt_cache_miss_tokens", usage.get("prompt_tokens", 0) - cache_hit)
+    logger.info(
+        "DeepSeek usage: total_tokens=%s, cache_hit_ratio=%.2f%%",
+        usage.get("total_tokens", 0), 100 * cache_hit / max(1, cache_hit + cache_miss)
+    )
+    if PROMETHEUS_AVAILABLE:
+        DEEPSEEK_PROMPT_TOKENS.labels(cache="hit").inc(cache_hit)
+        DEEPSEEK_PROMPT_TOKENS.labels(cache="miss").inc(cache_miss)
+        DEEPSEEK_COMPLETION_TOKENS.inc(usage.get("completion_tokens", 0))
+
+
+async def stream_chat_completion(
+    client: httpx.AsyncClient,
+    payload: Dict,
+    stop_when: Optional[Callable[[str], bool]] = None
+) -> str:
+    """Потоковый запрос к DeepSeek, чтение обрывается, как только stop_when(текст) истинно"""
+    await deepseek_bucket.acquire(estimate_tokens(payload))
+    chunks: List[str] = []
+    request = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+
+    async def read_stream():
+        async with client.stream("POST", "/chat/completions", json=request) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                chunk = orjson.loads(data)
+                # usage приходит последним чанком с пустым списком choices
+                if chunk.get("usage"):
+                    record_usage(chunk["usage"])
+                choices = chunk.get("choices")
+                delta = choices[0]["delta"].get("content") if choices else None
+                if not delta:
+                    continue
+                chunks.append(delta)
+                if stop_when and stop_when("".join(chunks)):
+                    # Выход из контекста закрывает поток, остаток ответа не генерируется впустую;
+                    # usage в таком случае не приходит - считаем только число обрывов
+                    if PROMETHEUS_AVAILABLE:
+                        DEEPSEEK_STREAM_EARLY_STOPS.inc()
+                    break
+
+    async with deepseek_semaphore:
+        await asyncio.wait_for(read_stream(), timeout=DEEPSEEK_TIMEOUT)
+
+    return "".join(chunks).strip()
+
+
+async def get_ai_response(
+    messages: List[Dict],
+    temperature: float = 0.7,
+    max_tokens: int = 800,
+    stream: bool = False,
+    stop_when: Optional[Callable[[str], bool]] = None,
+    json_mode: bool = False,
+    cache_when: Optional[Callable[[str], bool]] = None
+) -> str:
     """Отправляет запрос к DeepSeek API с кэшированием"""
-    # Проверяем кэш
-    cached = await ai_cache.get(messages)
-    if cached:
-        return cached
+    # Проверяем кэш (только для детерминированных вызовов)
+    cache_key = ai_cache.cache_key(messages, temperature, max_tokens)
+    if cache_key:
+        cached = await ai_cache.get(cache_key)
+        if cached:
+            return cached
 
     if not DEEPSEEK_API_KEY:
         return "Извините, API ключ DeepSeek не настроен. Проверьте конфигурацию."
 
+    payload = {
+        "model": DEEPSEEK_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": False
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+
     try:
-        # Используем общий клиент с пулом соединений
-        async with session_store.httpx_client as client:
-            response = await client.post(
-                "https://api.deepseek.com/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "deepseek-chat",
-                    "messages": messages,
-                    "max_tokens": 800,
-                    "temperature": temperature,
-                    "stream": False
-                }
-            )
+        # Общий клиент создается в lifespan и живет все время работы
+        if stream:
+            content = await stream_chat_completion(app.state.deepseek, payload, stop_when)
+            formatted_content = content if json_mode else format_ai_response(content)
+            if cache_key and (cache_when is None or cache_when(formatted_content)):
+                await ai_cache.set(cache_key, formatted_content)
+            return formatted_content
 
-            if response.status_code == 200:
-                data = response.json()
-                content = data["choices"][0]["message"]["content"].strip()
+        response = await post_chat_completion(app.state.deepseek, payload)
 
-                # Форматируем ответ для лучшего отображения
-                formatted_content = format_ai_response(content)
+        if response.status_code == 200:
+            data = response.json()
+            content = data["choices"][0]["message"]["content"].strip()
 
-                # Сохраняем в кэш
-                await ai_cache.set(messages, formatted_content)
+            # Следим за попаданиями в префиксный кэш DeepSeek
+            record_usage(data.get("usage", {}))
 
-                return formatted_content
-            else:
-                logger.error(f"DeepSeek API error: {response.status_code} - {response.text}")
-                return "Извините, произошла ошибка с нейросетью. Попробуйте еще раз."
+            # Форматируем ответ для лучшего отображения
+            formatted_content = content if json_mode else format_ai_response(content)
+
+            # Сохраняем в кэш
+            if cache_key and (cache_when is None or cache_when(formatted_content)):
+                await ai_cache.set(cache_key, formatted_content)
+
+            return formatted_content
+        else:
+            logger.error(f"DeepSeek API error: {response.status_code} - {response.text}")
+            return "Извините, произошла ошибка с нейросетью. Попробуйте еще раз."
 
-    except httpx.TimeoutException:
+    except (httpx.TimeoutException, asyncio.TimeoutError):
         logger.error("Timeout while calling DeepSeek API")
         return "Извините, нейросеть не отвечает. Попробуйте еще раз."
+    except httpx.HTTPStatusError as e:
+        logger.error(f"DeepSeek API error: {e.response.status_code}")
+        return "Извините, произошла ошибка с нейросетью. Попробуйте еще раз."
     except Exception as e:
         logger.error(f"Error while calling DeepSeek API: {e}")
         return "Извините, произошла ошибка с нейросетью. Попробуйте еще раз."
 
 
+_EXTRA_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*\n")
+_SHORT_SENTENCE_RE = re.compile(r"^[A-ZА-Я][^.!?]*[.!?]$")
+
+
+def _format_line(line: str) -> str:
+    """Оформление одной строки ответа: заголовки выделяются жирным или курсивом."""
+    line = line.strip()
+    if not line:
+        return line
+    if line.endswith(':') and len(line) < 50:
+        return f'**{line}**'
+    if len(line) < 100 and _SHORT_SENTENCE_RE.match(line):
+        return f'*{line}*'
+    return line
+
+
 def format_ai_response(text: str) -> str:
     """Форматирует ответ AI для лучшего отображения."""
     # Убираем лишние пробелы
-    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
-
-    # Добавляем форматирование для заголовков
-    lines = text.split('\n')
-    formatted_lines = []
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            formatted_lines.append('')
-            continue
-
-        # Определяем заголовки
-        if line.endswith(':') and len(line) < 50:
-            formatted_lines.append(f'**{line}**')
-        elif re.match(r'^[A-ZА-Я][^.!?]*[.!?]$', line) and len(line) < 100:
-            formatted_lines.append(f'*{line}*')
+    text = _EXTRA_BLANK_LINES_RE.sub('\n\n', text)
+    # Один проход по строкам, каждая обрезается ровно один раз
+    return '\n'.join([_format_line(line) for line in text.split('\n')])
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_action(action: str) -> str:
+    """Приводит действие к единому виду, чтобы похожие запросы попадали в кэш"""
+    return _WHITESPACE_RE.sub(" ", action).strip().rstrip(".!?…,;:").lower()
+
+
+# Частые заведомо допустимые действия проверяются без запроса к ИИ
+_ALWAYS_VALID_PREFIXES = (
+    "иду", "иди", "идти", "осмотр", "подоб", "взять", "атак", "удар", "говор", "сказ", "спрос", "ответ",
+    "жду", "жди", "беж", "спрят", "откры", "закры", "прыг"
+)
+_ALWAYS_VALID_RE = re.compile(r"^(?:" + "|".join(_ALWAYS_VALID_PREFIXES) + r")", re.IGNORECASE)
+# Попытки выйти за рамки игры отклоняются без запроса к ИИ
+_META_BLOCK_RE = re.compile(r"конец игры|я выиграл|я победил|god mode|режим бога", re.IGNORECASE)
+META_ACTION_REJECTION = "НЕТ. Это не действие персонажа, а попытка изменить правила игры."
+
+
+def is_always_valid(action: str) -> bool:
+    """Короткое действие с частым безопасным глаголом не требует проверки ИИ"""
+    action = action.strip()
+    return len(action) < 80 and bool(_ALWAYS_VALID_RE.match(action))
+
+
+def fast_validate(action: str) -> str:
+    """Локальная проверка: "OK", текст отказа или "UNKNOWN", если нужен ИИ"""
+    if _META_BLOCK_RE.search(action):
+        return META_ACTION_REJECTION
+    if is_always_valid(action):
+        return "OK"
+    return "UNKNOWN"
+
+
+INVALID_ACTION_REASON = "Это действие невозможно в текущей ситуации."
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def is_complete_json(text: str) -> bool:
+    """Ответ уже содержит законченный JSON (в JSON-режиме модель может дописывать пробелы)"""
+    if not text.rstrip().endswith("}"):
+        return False
+    try:
+        orjson.loads(text)
+        return True
+    except orjson.JSONDecodeError:
+        return False
+
+
+def judgement_data(text: str) -> Optional[Dict[str, Any]]:
+    """JSON-объект оценки из ответа ИИ или None, если его не удалось разобрать"""
+    match = _JSON_OBJECT_RE.search(text)
+    try:
+        data = orjson.loads(match.group(0)) if match else None
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def is_judgement(text: str) -> bool:
+    """Ответ судьи разбирается - только такие ответы можно кэшировать"""
+    return judgement_data(text) is not None
+
+
+_TRUE_WORDS = frozenset({"true", "yes", "да", "1"})
+
+
+def _as_bool(value: Any) -> bool:
+    """Модель может вернуть булево значение строкой или числом"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    return str(value).strip().lower() in _TRUE_WORDS
+
+
+def parse_judgement(text: str) -> Dict[str, Any]:
+    """Разбирает оценку действия; неразобранный ответ (обрыв, ошибка API) считается отказом с общей причиной"""
+    data = judgement_data(text)
+    if data is None:
+        # Сырой текст игроку не показываем: это может быть обрывок JSON или текст ошибки
+        return {"valid": False, "reason": INVALID_ACTION_REASON, "difficulty": DEFAULT_DIFFICULTY}
+
+    # Модель иногда отвечает строкой вроде "7/10" или "сложность 7"
+    digits = _DIGITS_RE.search(str(data.get("difficulty", "")))
+    difficulty = int(digits.group(0)) if digits else DEFAULT_DIFFICULTY
+
+    return {
+        "valid": _as_bool(data.get("valid")),
+        "reason": str(data.get("reason") or "").strip() or INVALID_ACTION_REASON,
+        "difficulty": min(10, max(1, difficulty))
+    }
+
+
+def action_chance(difficulty: int) -> float:
+    """Шанс успеха по сложности 1-10: средняя сложность дает 50%, минимум 5%"""
+    return max(5.0, 100.0 - difficulty * 10)
+
+
+def world_prompt(session: UserSession) -> str:
+    """Неизменная в течение игры часть запросов: правила и контекст мира"""
+    if session.ruleset:
+        return f"ПРАВИЛА МИРА: {session.ruleset}\n\nКОНТЕКСТ МИРА: {session.world_context}"
+    return f"КОНТЕКСТ МИРА: {session.world_context}"
+
+
+def build_outcome_request(session: UserSession, action: str, outcome: str) -> tuple[List[Dict], List[Dict]]:
+    """История с новым ходом и полный запрос исхода к ИИ"""
+    prompt_for_outcome = (
+        f"Игрок совершил действие: '{action}'.\n\n"
+        f"Это действие было {outcome.upper()}ОМ.\n\n"
+        f"Опиши подробный исход этого действия, исходя из результата ({outcome}). "
+        f"Будь красочным и атмосферным (3-4 предложения)."
+    )
+    # Системный промпт и история идут от неизменного к изменчивому:
+    # между ходами начало запроса совпадает и попадает в префиксный кэш DeepSeek
+    history = session.messages + [{"role": "user", "content": prompt_for_outcome}]
+    outcome_messages = [
+        {"role": "system", "content": f"{STORY_SYS}\n\n{world_prompt(session)}"}
+    ] + history
+    return history, outcome_messages
+
+
+async def summarize_history(world_context: str, messages: List[Dict]) -> Optional[str]:
+    """Сворачивает выпадающие из истории сообщения в контекст мира; None - оставить прежний"""
+    if not DEEPSEEK_API_KEY:
+        return None
+
+    events = "\n\n".join(m["content"] for m in messages)
+    try:
+        response = await post_chat_completion(app.state.deepseek, {
+            "model": DEEPSEEK_MODEL,
+            "messages": [
+                {"role": "system", "content": SUMMARY_SYS},
+                {"role": "user", "content": f"ПРЕДЫСТОРИЯ: {world_context}\n\nНОВЫЕ СОБЫТИЯ:\n{events}"}
+            ],
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "temperature": 0.3,
+            "stream": False
+        })
+        if response.status_code != 200:
+            logger.error(f"History summary failed: {response.status_code}")
+            return None
+        return response.json()["choices"][0]["message"]["content"].strip() or None
+    except Exception as e:
+        logger.error(f"History summary failed: {e}")
+        return None
+
+
+async def validate_action_logic(player_action: str, session: UserSession) -> Dict[str, Any]:
+    """Оценивает действие одним запросом: возможно ли оно, почему нет и насколько оно сложно"""
+    messages = [
+        {"role": "system", "content": VALIDATE_SYS},
+        {"role": "user", "content": f"{world_prompt(session)}\n\nДЕЙСТВИЕ: {normalize_action(player_action)}"}
+    ]
+    response = await get_ai_response(
+        messages, temperature=0.3, max_tokens=JUDGE_MAX_TOKENS, stream=True, stop_when=is_complete_json, json_mode=True,
+        cache_when=is_judgement
+    )
+    return parse_judgement(response)
+
+
+# Служебные блоки в ответе ИИ: CHARACTER_DATA - до конца текста, INVENTORY_ADD - до конца строки
+_HIDDEN_RE = re.compile(
+    r"CHARACTER_DATA:\s*(?P<data>[\s\S]+)|INVENTORY_ADD:\s*(?P<items>.+)",
+    re.IGNORECASE
+)
+_INVENTORY_RE = re.compile(r"INVENTORY_ADD:\s*(.+)", re.IGNORECASE)
+_CHARACTER_RE = re.compile(r"CHARACTER_DATA:\s*(.+)", re.IGNORECASE | re.DOTALL)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
+
+def parse_ai_response(text: str) -> tuple[str, list[str], dict, dict]:
+    """Разбирает ответ ИИ за один проход: видимый текст, предметы, характеристики и способности"""
+    items: list[str] = []
+    character_data: dict = {}
+
+    def add_items(items_string: str):
+        if not items:
+            items.extend(item.strip() for item in items_string.strip().split(","))
+
+    def add_character_data(data_string: str):
+        if not character_data:
+            try:
+                character_data.update(orjson.loads(data_string.strip()))
+            except orjson.JSONDecodeError:
+                logger.error("Failed to parse CHARACTER_DATA JSON")
+
+    def extract(match: re.Match) -> str:
+        # Блок, поглощенный соседним (в той же строке или после CHARACTER_DATA),
+        # ищем внутри него - такие ответы редки
+        if match.group("items") is not None:
+            add_items(match.group("items"))
+            nested = _CHARACTER_RE.search(match.group("items"))
+            if nested:
+                add_character_data(nested.group(1))
         else:
-            formatted_lines.append(line)
+            data_string = match.group("data")
+            nested = _INVENTORY_RE.search(data_string)
+            if nested:
+                add_items(nested.group(1))
+                # JSON характеристик заканчивается до строки с предметами
+                data_string = data_string[:nested.start()]
+            add_character_data(data_string)
+        return ""
 
-    return '\n'.join(formatted_lines)
+    visible = _BLANK_LINES_RE.sub("\n", _HIDDEN_RE.sub(extract, text)).strip()
+    return visible, items, character_data.get("stats", {}), character_data.get("abilities", {})
 
 
 # Генерация ID пользователя
 def generate_user_id() -> str:
     """Генерирует уникальный ID пользователя."""
-    return f"user_{random.randint(100000, 999999)}_{int(datetime.now().timestamp())}"
+    return f"user_{uuid.uuid4().hex}"
 
 
 # --- РОУТЫ С RATE LIMITING ---
@@ -457,13 +1230,13 @@ def generate_user_id() -> str:
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Главная страница."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return render_page("index.html", request)
 
 
 @app.get("/game", response_class=HTMLResponse)
 async def game_page(request: Request):
     """Страница игры."""
-    return templates.TemplateResponse("game.html", {"request": request})
+    return render_page("game.html", request)
 
 
 @app.post("/api/start-game")
@@ -474,15 +1247,10 @@ async def start_game(request: Request):
     session = UserSession(user_id=user_id)
     await session_store.set(user_id, session)
 
-    return JSONResponse({
+    return ORJSONResponse({
         "user_id": user_id,
         "message": "Новая игра создана! Выберите вселенную.",
-        "universes": [
-            {"id": "fantasy", "name": "🧙 Фэнтези", "description": "Мир магии и драконов"},
-            {"id": "cyberpunk", "name": "🚀 Киберпанк", "description": "Технологии и корпорации"},
-            {"id": "space", "name": "🪐 Космоопера", "description": "Межзвездные путешествия"},
-            {"id": "custom", "name": "🎨 Своя вселенная", "description": "Создайте свой мир"}
-        ]
+        "universes": UNIVERSES
     })
 
 
@@ -490,7 +1258,7 @@ async def start_game(request: Request):
 @limiter.limit("10/minute")
 async def choose_universe(request: Request):
     """Выбор вселенной."""
-    data = await request.json()
+    data = await read_json(request)
     user_id = data.get("user_id")
     universe_id = data.get("universe_id")
     custom_rules = data.get("custom_rules", "")
@@ -500,19 +1268,17 @@ async def choose_universe(request: Request):
         raise HTTPException(status_code=404, detail="Сессия не найдена")
 
     # Определяем правила вселенной
-    universes = {
-        "fantasy": "Классическое фэнтези с магами, драконами и древними артефактами. Магия управляется мантрой и жезлами.",
-        "cyberpunk": "Мир недалекого будущего, где технологии правят миром, кибернетические импланты - обыденность.",
-        "space": "Эпоха межзвездных путешествий, инопланетных цивилизаций и космических битв.",
-        "custom": custom_rules or "Вы сами определяете законы мира."
-    }
+    if universe_id == "custom":
+        ruleset = custom_rules or CUSTOM_UNIVERSE_RULES
+    else:
+        ruleset = UNIVERSE_RULES.get(universe_id, "Правила определены игроком.")
 
     session.universe = universe_id
-    session.ruleset = universes.get(universe_id, "Правила определены игроком.")
+    session.ruleset = ruleset
     session.update_activity()
     await session_store.set(user_id, session)
 
-    return JSONResponse({
+    return ORJSONResponse({
         "success": True,
         "message": f"Вселенная выбрана! Теперь опишите своего персонажа.",
         "need_character": True,
@@ -522,9 +1288,9 @@ async def choose_universe(request: Request):
 
 @app.post("/api/create-character")
 @limiter.limit("10/minute")
-async def create_character(request: Request, background_tasks: BackgroundTasks):
+async def create_character(request: Request):
     """Создание персонажа."""
-    data = await request.json()
+    data = await read_json(request)
     user_id = data.get("user_id")
     character_prompt = data.get("character_prompt")
 
@@ -540,24 +1306,17 @@ async def create_character(request: Request, background_tasks: BackgroundTasks):
 
     # Создаем персонажа с помощью AI если доступен
     if DEEPSEEK_API_KEY:
-        full_prompt = (
-            f"Ты - Мастер Игры. Создай начало истории.\n\n"
-            f"ПРАВИЛА МИРА: {session.ruleset}\n"
-            f"ЖЕЛАНИЕ ИГРОКА: '{character_prompt}'.\n\n"
-            f"ЗАДАНИЕ:\n"
-            f"1. Создай краткое, но атмосферное описание персонажа и стартовой локации (3-4 абзаца).\n"
-            f"2. Опиши событие, с которого начинается игра.\n"
-            f"3. Используй **жирный текст** для важных моментов и *курсив* для атмосферы.\n"
-            f"4. В конце добавь строки:\n"
-            f"INVENTORY_ADD: предмет1, предмет2, предмет3\n"
-            f"CHARACTER_DATA: {{\"stats\": {{\"Сила\": 8, \"Ловкость\": 7, \"Интеллект\": 6, \"Мудрость\": 5, \"Харизма\": 4}}, \"abilities\": {{\"Паркур\": true, \"Скрытность\": true}}}}"
-        )
-
-        messages = [{"role": "user", "content": full_prompt}]
-        # Запускаем в фоне с таймаутом
-        background_tasks.add_task(update_session_character, user_id, messages, character_prompt)
+        messages = [
+            {"role": "system", "content": GAMEMASTER_SYS},
+            {"role": "user", "content": f"ПРАВИЛА МИРА: {session.ruleset}\nЖЕЛАНИЕ ИГРОКА: '{character_prompt}'."}
+        ]
+        # Ставим в очередь фоновой обработки
+        try:
+            character_queue.put_nowait((user_id, messages, character_prompt))
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Сервер перегружен, попробуйте позже")
 
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "message": "Персонаж создается...",
             "processing": True
@@ -572,7 +1331,7 @@ async def create_character(request: Request, background_tasks: BackgroundTasks):
 
         await _finalize_character_creation(session, character_prompt, story, items_to_add, stats, abilities)
 
-        return JSONResponse({
+        return ORJSONResponse({
             "success": True,
             "game_started": True,
             "story": story,
@@ -593,35 +1352,9 @@ async def update_session_character(user_id: str, messages: List[Dict], character
 
         response_text = await get_ai_response(messages)
 
-        # Обработка инвентаря и характеристик (как в оригинале)
-        def process_inventory_command(text: str) -> tuple[str, list[str]]:
-            match = re.search(r"INVENTORY_ADD:\s*(.+)", text, re.IGNORECASE)
-            if match:
-                items_string = match.group(1).strip()
-                found_items = [item.strip() for item in items_string.split(',')]
-                cleaned_text = text.replace(match.group(0), "").strip()
-                return cleaned_text, found_items
-            return text, []
-
-        def parse_character_data_block(text: str) -> tuple[dict, dict]:
-            match = re.search(r"CHARACTER_DATA:\s*(.+)", text, re.IGNORECASE | re.DOTALL)
-            if match:
-                try:
-                    data_string = match.group(1).strip()
-                    data = json.loads(data_string)
-                    return data.get("stats", {}), data.get("abilities", {})
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse CHARACTER_DATA JSON")
-            return {}, {}
-
-        def clean_hidden_data(text: str) -> str:
-            text = re.sub(r"CHARACTER_DATA:\s*.+", "", text, flags=re.IGNORECASE | re.DOTALL)
-            text = re.sub(r"INVENTORY_ADD:\s*.+", "", text, flags=re.IGNORECASE)
-            return "\n".join(line for line in text.split("\n") if line.strip()).strip()
-
-        items_to_add = process_inventory_command(response_text)[1]
-        stats, abilities = parse_character_data_block(response_text)
-        player_visible_message = clean_hidden_data(response_text)
+        player_visible_message, items_to_add, stats, abilities = parse_ai_response(response_text)
+        # ИИ может выйти за пределы 0-20, которые проверяет SaveData
+        stats = {name: min(20, max(0, value)) for name, value in stats.items() if isinstance(value, int)}
 
         # Значения по умолчанию
         if not stats:
@@ -652,11 +1385,11 @@ async def _finalize_character_creation(session: UserSession, character_prompt: s
     await session_store.set(session.user_id, session)
 
 
-@app.post("/api/action")
+@app.post("/api/action", response_model=Union[ActionResponse, ActionRejectedResponse, GameOverResponse])
 @limiter.limit("30/minute")
 async def perform_action(request: Request):
     """Выполнение действия в игре."""
-    data = await request.json()
+    data = await read_json(request)
     user_id = data.get("user_id")
     action = data.get("action")
 
@@ -668,107 +1401,109 @@ async def perform_action(request: Request):
         raise HTTPException(status_code=404, detail="Сессия не найдена")
 
     if session.game_over:
-        return JSONResponse({
-            "success": False,
-            "message": "Игра окончена. Начните новую игру.",
-            "game_over": True
-        })
+        return GameOverResponse(game_over=True)
 
-    # Оригинальная логика действий...
-    # (сохранена из вашего кода для краткости)
-
-    # Валидация логики действия
-    async def validate_action_logic(player_action: str, world_context: str) -> str:
-        prompt = (
-            f"Ты - Мастер Игры. Игрок пытается совершить действие: '{player_action}'. "
-            f"Текущий контекст: '{world_context}'.\n\n"
-            f"Если это действие невозможно или нелогично, объясни игроку, почему это нельзя сделать, "
-            f"в короткой повествовательной форме (1-2 предложения).\n\n"
-            f"Если действие возможно, просто ответь 'ДА'."
-        )
-        messages = [{"role": "user", "content": prompt}]
-        return (await get_ai_response(messages, temperature=0.3)).strip()
+    verdict = fast_validate(action)
+    if verdict not in ("OK", "UNKNOWN"):
+        return ActionRejectedResponse(message=verdict, action_result=verdict)
 
-    validation_response = await validate_action_logic(action, session.world_context)
+    roll = dice.random() * 100
 
-    if "ДА" not in validation_response.upper():
-        return JSONResponse({
-            "success": False,
-            "message": validation_response,
-            "action_result": validation_response,
-            "type": "validation_error"
-        })
+    # Оценка и исход почти независимы - исход запрашиваем сразу, считая
+    # сложность средней, а после оценки отменяем его, если он не подходит
+    speculative_success = roll < action_chance(DEFAULT_DIFFICULTY)
+    history, outcome_messages = build_outcome_request(
+        session, action, "успех" if speculative_success else "неудача"
+    )
+    outcome_task = asyncio.create_task(get_ai_response(outcome_messages))
 
-    # Расчет шанса (упрощенный)
-    difficulty = 5  # Упрощаем для примера
-    success_chance = 50.0
+    difficulty = DEFAULT_DIFFICULTY
+    if verdict == "UNKNOWN":
+        try:
+            judgement = await validate_action_logic(action, session)
+        except BaseException:
+            outcome_task.cancel()
+            raise
 
-    roll = random.random() * 100
+        if not judgement["valid"]:
+            outcome_task.cancel()
+            return ActionRejectedResponse(message=judgement["reason"], action_result=judgement["reason"])
+        difficulty = judgement["difficulty"]
+
+    success_chance = action_chance(difficulty)
     is_success = roll < success_chance
     outcome = "успех" if is_success else "неудача"
 
-    logger.info(f"Action: {action}, Chance: {success_chance:.2f}, Roll: {roll:.2f}, Outcome: {outcome}")
+    # Если после хода история будет обрезана, выпадающие из нее сообщения
+    # сворачиваются в контекст мира параллельно с запросом исхода
+    summary_task = None
+    dropped = len(session.messages) + 2 - PROMPT_HISTORY_MESSAGES
+    if len(session.messages) + 2 > MAX_HISTORY_MESSAGES:
+        summary_task = asyncio.create_task(
+            summarize_history(session.world_context, session.messages[:dropped])
+        )
 
-    # Запрос исхода у ИИ
-    prompt_for_outcome = (
-        f"Игрок совершил действие: '{action}'.\n\n"
-        f"Это действие было {outcome.upper()}ОМ.\n\n"
-        f"Опиши подробный исход этого действия, исходя из результата ({outcome}). "
-        f"Будь красочным и атмосферным (3-4 предложения)."
+    if is_success == speculative_success:
+        response_text = await outcome_task
+    else:
+        # Сложность изменила исход броска - нужен другой текст
+        outcome_task.cancel()
+        history, outcome_messages = build_outcome_request(session, action, outcome)
+        response_text = await get_ai_response(outcome_messages)
+
+    logger.info(
+        "Action: %s, Difficulty: %d, Chance: %.2f, Roll: %.2f, Outcome: %s",
+        action, difficulty, success_chance, roll, outcome
     )
 
-    session.messages.append({"role": "user", "content": prompt_for_outcome})
-    response_text = await get_ai_response(session.messages)
-
-    session.messages.append({"role": "assistant", "content": response_text})
+    history.append({"role": "assistant", "content": response_text})
+    # История обрезается блоком, а не по сообщению за ход - иначе префикс
+    # запроса сдвигался бы каждый ход; выпавшие события пересказаны в контексте мира
+    if len(history) > MAX_HISTORY_MESSAGES:
+        history = history[-PROMPT_HISTORY_MESSAGES:]
+    session.messages = history
+    if summary_task:
+        session.world_context = await summary_task or session.world_context
     session.update_activity()
     await session_store.set(user_id, session)
 
     outcome_icon = "✅" if is_success else "❌"
     formatted_result = f"## 📖 Результат действия\n\n{response_text}\n\n---\n🎲 **Шанс успеха:** {success_chance:.0f}%\n🎯 **Выпало:** {roll:.0f}\n{outcome_icon} **Результат:** {outcome}"
 
-    return JSONResponse({
-        "success": True,
-        "action_result": formatted_result,
-        "chance": success_chance,
-        "rolled": roll,
-        "outcome": outcome,
-        "inventory": session.inventory,
-        "health": session.health,
-        "type": "action_result"
-    })
+    return ActionResponse(
+        action_result=formatted_result,
+        chance=success_chance,
+        rolled=roll,
+        outcome=outcome,
+        inventory=session.inventory,
+        health=session.health
+    )
 
 
-@app.post("/api/save-game")
+@app.post("/api/save-game", response_model=SaveGameResponse)
 @limiter.limit("5/minute")
 async def save_game(request: Request):
     """Сохранение игры."""
-    data = await request.json()
+    data = await read_json(request)
     user_id = data.get("user_id")
 
     session = await session_store.get(user_id)
     if not session:
         raise HTTPException(status_code=404, detail="Сессия не найдена")
 
-    save_data = session.to_save_data()
-
-    return JSONResponse({
-        "success": True,
-        "save_data": save_data.dict(),
-        "message": "Игра сохранена"
-    })
+    return SaveGameResponse(save_data=session.to_save_data())
 
 
-@app.post("/api/load-game")
+@app.post("/api/load-game", response_model=LoadGameResponse)
 @limiter.limit("5/minute")
 async def load_game(request: Request):
     """Загрузка сохраненной игры."""
-    data = await request.json()
+    data = await read_json(request)
     user_id = data.get("user_id")
 
     try:
         # Валидация через Pydantic
-        save_data = SaveData(**data.get("save_data", {}))
+        save_data = SaveData.model_validate(data.get("save_data", {}))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Некорректные данные сохранения: {str(e)}")
 
@@ -786,17 +1521,39 @@ async def load_game(request: Request):
 
     await session_store.set(user_id, session)
 
-    return JSONResponse({
-        "success": True,
-        "message": "Игра загружена",
-        "game_data": {
-            "inventory": session.inventory,
-            "stats": session.stats,
-            "abilities": list(session.abilities.keys()),
-            "health": session.health,
-            "character": session.character
-        }
-    })
+    return LoadGameResponse(game_data=GameData(
+        inventory=session.inventory,
+        stats=session.stats,
+        abilities=list(session.abilities.keys()),
+        health=session.health,
+        character=session.character
+    ))
+
+
+_STATUS_FIELDS = frozenset(
+    {"user_id", "character", "inventory", "health", "stats", "abilities", "world_context", "game_over"}
+)
+
+
+@app.get("/api/status/{user_id}")
+@limiter.limit("60/minute")
+async def get_status(request: Request, user_id: str):
+    """Текущее состояние игрока; неизменившееся состояние отдается как 304."""
+    session = await session_store.get(user_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+
+    status = session.model_dump(mode="json", include=_STATUS_FIELDS)
+    # Клиенту нужны только названия способностей
+    status["abilities"] = list(session.abilities)
+    body = orjson.dumps(status)
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    # no-cache: браузер обязан перепроверять ETag при каждом опросе
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.get("/health")
@@ -805,20 +1562,23 @@ async def health_check():
     redis_status = "connected" if session_store.redis_client else "disabled"
     sessions_count = len(session_store.in_memory_store)
 
-    return JSONResponse({
+    return ORJSONResponse({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "active_sessions": sessions_count,
         "redis": redis_status,
         "ai_available": bool(DEEPSEEK_API_KEY),
+        "ai_cache": ai_cache.stats,
         "version": "2.0.0"
     })
 
 
 @app.get("/metrics")
 async def metrics():
-    """Метрики Prometheus (автоматически генерируются Instrumentator)."""
-    return JSONResponse({"message": "Use /metrics endpoint for Prometheus"})
+    """Метрики Prometheus."""
+    if not PROMETHEUS_AVAILABLE:
+        return ORJSONResponse({"message": "prometheus_client не установлен"}, status_code=503)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.post("/api/debug/clear-sessions")
@@ -826,23 +1586,13 @@ async def metrics():
 async def clear_sessions(request: Request):
     """Очистка всех сессий (только для отладки)."""
     # Простая защита - проверяем специальный ключ
-    data = await request.json()
+    data = await read_json(request)
     if data.get("admin_key") != os.getenv("ADMIN_KEY", "debug123"):
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    count = len(session_store.in_memory_store)
-    session_store.in_memory_store.clear()
-
-    # Очищаем Redis если есть
-    if session_store.redis_client:
-        try:
-            keys = await session_store.redis_client.keys("session:*")
-            if keys:
-                await session_store.redis_client.delete(*keys)
-        except Exception as e:
-            logger.error(f"Failed to clear Redis: {e}")
+    count = await session_store.clear()
 
-    return JSONResponse({
+    return ORJSONResponse({
         "message": f"Очищено {count} сессий",
         "remaining_sessions": 0
     })
@@ -859,5 +1609,7 @@ if __name__ == "__main__":
         app,
         host=WEBAPP_HOST,
         port=WEBAPP_PORT,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
@@ -273,9 +273,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Периодически проверяем статус создания персонажа
             const checkInterval = setInterval(async () => {
                 try {
-                    const status = await this.apiRequest('/api/get-status', {
-                        user_id: this.userId
-                    }, 'POST');
+                    const status = await this.apiRequest(`/api/status/${encodeURIComponent(this.userId)}`, null, 'GET');
 
                     if (status.character === characterPrompt) {
                         clearInterval(checkInterval);
@@ -432,9 +430,7 @@ document.addEventListener('DOMContentLoaded', function() {
             if (!this.userId) return;
 
             try {
-                const status = await this.apiRequest('/api/get-status', {
-                    user_id: this.userId
-                }, 'POST');
+                const status = await this.apiRequest(`/api/status/${encodeURIComponent(this.userId)}`, null, 'GET');
 
                 if (status.character) {
                     this.gameStarted = true;
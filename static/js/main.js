@@ -47,7 +47,7 @@ document.addEventListener('DOMContentLoaded', function() {
               'POST /api/choose-universe - Выбрать вселенную\n' +
               'POST /api/create-character - Создать персонажа\n' +
               'POST /api/action - Выполнить действие\n' +
-              'POST /api/get-status - Получить статус\n' +
+              'GET /api/status/{user_id} - Получить статус\n' +
               'POST /api/save-game - Сохранить игру\n' +
               'POST /api/load-game - Загрузить игру\n' +
               'GET /health - Проверка здоровья');
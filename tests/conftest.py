@@ -0,0 +1,41 @@
+import httpx
+import pytest
+from main import app, limiter, session_store
+
+
+def pytest_collection_modifyitems(config, items):
+    # При запуске через pytest-xdist с --dist loadgroup все serial-тесты
+    # попадают в одну группу и выполняются одним воркером
+    if not config.pluginmanager.hasplugin("xdist"):
+        return
+    for item in items:
+        if item.get_closest_marker("serial"):
+            item.add_marker(pytest.mark.xdist_group("serial"))
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def client(anyio_backend, tmp_path_factory):
+    # Один клиент на весь прогон: lifespan приложения запускается один раз,
+    # запросы идут в приложение напрямую через ASGI, без потока на каждый вызов.
+    # Резервная копия сессий пишется во временный каталог, а не в рабочую копию
+    backup_file = session_store.backup_file
+    session_store.backup_file = str(tmp_path_factory.mktemp("data") / "sessions_backup.json")
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+                yield c
+    finally:
+        session_store.backup_file = backup_file
+
+
+@pytest.fixture(autouse=True)
+def _reset_limiter():
+    # Каждый тест начинает с пустыми счетчиками лимитов
+    limiter.reset()
+    yield
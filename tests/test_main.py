@@ -1,20 +1,42 @@
+import asyncio
+import time
+
+import httpx
+import limits.storage.memory
+import orjson
 import pytest
-from fastapi.testclient import TestClient
-from main import app
+from pydantic import ValidationError
+
+import main
+from main import (
+    DEFAULT_DIFFICULTY,
+    INVALID_ACTION_REASON,
+    SaveData,
+    SessionStore,
+    UserSession,
+    is_judgement,
+    parse_ai_response,
+    parse_judgement,
+    session_store,
+    stream_chat_completion,
+)
+
+_OVERSIZED_ITEM = "item" * 100
+INVALID_SAVE = {"user_id": "test", "save_data": {"health": 200, "inventory": [_OVERSIZED_ITEM]}}
 
-client = TestClient(app)
+pytestmark = pytest.mark.anyio
 
 
-def test_health_check():
-    response = client.get("/health")
+async def test_health_check(client):
+    response = await client.get("/health")
     assert response.status_code == 200
     data = response.json()
     assert data["status"] == "healthy"
     assert "active_sessions" in data
 
 
-def test_start_game():
-    response = client.post("/api/start-game")
+async def test_start_game(client):
+    response = await client.post("/api/start-game")
     assert response.status_code == 200
     data = response.json()
     assert "user_id" in data
@@ -22,26 +44,284 @@ def test_start_game():
     assert len(data["universes"]) == 4
 
 
-def test_rate_limiting():
-    # Делаем 11 запросов быстро
-    responses = []
-    for _ in range(11):
-        response = client.post("/api/start-game")
-        responses.append(response.status_code)
+class FakeClock:
+    """Подменяет time для хранилища лимитов: окно двигается только вручную"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.mark.serial
+async def test_rate_limiting(client, monkeypatch):
+    clock = FakeClock(time.time())
+    monkeypatch.setattr(limits.storage.memory, "time", clock)
+
+    # Исчерпываем лимит 10/minute одновременными запросами
+    responses = await asyncio.gather(*[client.post("/api/start-game") for _ in range(10)])
+    assert all(response.status_code == 200 for response in responses)
+
+    # Одиннадцатый запрос в той же минуте должен получить 429
+    response = await client.post("/api/start-game")
+    assert response.status_code == 429
+
+    # Через минуту лимит восстанавливается
+    clock.now += 61
+    response = await client.post("/api/start-game")
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("save_data", [
+    # Невалидное здоровье и слишком длинное название предмета
+    INVALID_SAVE["save_data"],
+    # В сохранении нет user_id
+    {},
+    # Характеристика вне диапазона 0-20
+    {"user_id": "test", "stats": {"Сила": 25}},
+    # Отрицательное здоровье
+    {"user_id": "test", "health": -1},
+    # Слишком длинное название предмета
+    {"user_id": "test", "inventory": [_OVERSIZED_ITEM]},
+])
+def test_save_data_validation(save_data):
+    with pytest.raises(ValidationError):
+        SaveData.model_validate(save_data)
+
+
+@pytest.mark.parametrize("payload,status", [
+    (INVALID_SAVE, 400),
+    ({"user_id": "test", "save_data": {"user_id": "test", "health": 50, "inventory": ["факел"]}}, 200),
+])
+async def test_load_validation_http(client, payload, status):
+    # Ошибка валидации должна превращаться в 400, корректное сохранение - загружаться
+    response = await client.post("/api/load-game", json=payload)
+    assert response.status_code == status
+
+
+
+async def test_save_load_round_trip(client):
+    user_id = (await client.post("/api/start-game")).json()["user_id"]
+    session = await session_store.get(user_id)
+    session.inventory = ["<b>sword</b>", "факел"]
+    session.stats = {"Сила": 12}
+    await session_store.set(user_id, session)
+
+    response = await client.post("/api/save-game", json={"user_id": user_id})
+    assert response.status_code == 200
+    save_data = response.json()["save_data"]
+    # Теги из ответа ИИ не попадают в сохранение
+    assert save_data["inventory"] == ["bsword/b", "факел"]
+
+    response = await client.post("/api/load-game", json={"user_id": user_id, "save_data": save_data})
+    assert response.status_code == 200
+    assert response.json()["game_data"]["inventory"] == ["bsword/b", "факел"]
+
+class FakeRedis:
+    """Минимальный общий Redis в памяти для нескольких SessionStore"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def make_store(tmp_path, redis_client=None) -> SessionStore:
+    store = SessionStore(backup_file=str(tmp_path / "sessions_backup.json"))
+    store.redis_client = redis_client
+    return store
+
+
+async def test_session_store_reads_other_worker_writes(tmp_path):
+    # Два воркера с общим Redis: каждый должен видеть запись другого
+    redis_client = FakeRedis()
+    first = make_store(tmp_path, redis_client)
+    second = make_store(tmp_path, redis_client)
+
+    session = UserSession(user_id="u1")
+    await first.set("u1", session)
+    assert (await second.get("u1")).character is None
+
+    updated = session.model_copy(update={"character": "Следопыт"})
+    await second.set("u1", updated)
+    assert (await first.get("u1")).character == "Следопыт"
+
+    await second.delete("u1")
+    assert await first.get("u1") is None
 
-    # Последний должен быть 429
-    assert 429 in responses
 
 
-def test_save_load_validation():
-    # Тест с некорректными данными
-    invalid_data = {
-        "user_id": "test",
-        "save_data": {
-            "health": 200,  # Невалидное здоровье
-            "inventory": ["item" * 100]  # Слишком длинное название
-        }
+async def test_cleanup_keeps_session_refreshed_by_other_worker(tmp_path):
+    redis_client = FakeRedis()
+    first = make_store(tmp_path, redis_client)
+    second = make_store(tmp_path, redis_client)
+
+    await first.set("u1", UserSession(user_id="u1", last_active_ts=time.time() - 25 * 3600))
+    # Другой воркер продолжает игру и пишет свежую сессию
+    session = await second.get("u1")
+    session.update_activity()
+    await second.set("u1", session)
+
+    # Первый воркер вытесняет только свою устаревшую копию, ключ в Redis остается
+    assert await first.cleanup_expired() == 1
+    assert "u1" not in first.in_memory_store
+    assert await second.get("u1") is not None
+    assert (await first.get("u1")).last_active_ts == session.last_active_ts
+
+async def test_cleanup_expired_keeps_refreshed_sessions(tmp_path):
+    store = make_store(tmp_path)
+    day_ago = time.time() - 25 * 3600
+
+    idle = UserSession(user_id="idle", last_active_ts=day_ago)
+    await store.set("idle", idle)
+    # Две записи в куче для одного игрока: удаляться и считаться он должен один раз
+    await store.set("idle", idle)
+
+    active = UserSession(user_id="active", last_active_ts=day_ago)
+    await store.set("active", active)
+    # Активность обновилась без нового set: в куче осталась только старая запись
+    active.update_activity()
+
+    assert await store.cleanup_expired() == 1
+    assert await store.get("idle") is None
+    assert await store.get("active") is active
+
+    # Обновленная сессия вернулась в кучу с новым сроком
+    assert await store.cleanup_expired() == 0
+    assert await store.get("active") is active
+
+
+@pytest.mark.parametrize("text,expected", [
+    # Обрыв на JUDGE_MAX_TOKENS
+    ('{"valid": false, "reason": "Вы не можете лет', (False, INVALID_ACTION_REASON, DEFAULT_DIFFICULTY)),
+    # Сложность строкой
+    ('{"valid": true, "reason": "", "difficulty": "7/10"}', (True, INVALID_ACTION_REASON, 7)),
+    # Булевы значения строкой и числом
+    ('{"valid": "true", "difficulty": 3}', (True, INVALID_ACTION_REASON, 3)),
+    ('{"valid": "false", "reason": "Нет крыльев", "difficulty": 3}', (False, "Нет крыльев", 3)),
+    ('{"valid": 1, "difficulty": 12}', (True, INVALID_ACTION_REASON, 10)),
+    ('{"valid": 0, "reason": "Слишком далеко", "difficulty": 0}', (False, "Слишком далеко", 1)),
+    # Сложность не указана
+    ('{"valid": true, "difficulty": null}', (True, INVALID_ACTION_REASON, DEFAULT_DIFFICULTY)),
+    # Не JSON: ошибка API и JSON не-объект
+    ("Извините, нейросеть не отвечает. Попробуйте еще раз.", (False, INVALID_ACTION_REASON, DEFAULT_DIFFICULTY)),
+    ("[1]", (False, INVALID_ACTION_REASON, DEFAULT_DIFFICULTY)),
+])
+def test_parse_judgement(text, expected):
+    judgement = parse_judgement(text)
+    assert (judgement["valid"], judgement["reason"], judgement["difficulty"]) == expected
+
+
+def test_unparsable_judgement_is_not_cacheable():
+    assert is_judgement('{"valid": true, "difficulty": 4}')
+    assert not is_judgement('{"valid": false, "reason": "Вы не можете лет')
+    assert not is_judgement("[1]")
+
+
+def sse_transport(*events) -> httpx.MockTransport:
+    body = b"".join(b"data: " + orjson.dumps(event) + b"\n\n" for event in events) + b"data: [DONE]\n\n"
+    return httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+
+
+@pytest.mark.parametrize("stop_when,expected_usage", [
+    # Поток дочитан до конца - usage учитывается
+    (None, True),
+    # Ранний обрыв закрывает поток, usage не ждем
+    (main.is_complete_json, False),
+])
+async def test_stream_usage(monkeypatch, stop_when, expected_usage):
+    usage = {"prompt_tokens": 90, "prompt_cache_hit_tokens": 64, "completion_tokens": 12, "total_tokens": 102}
+    recorded = []
+    monkeypatch.setattr(main, "record_usage", recorded.append)
+    transport = sse_transport(
+        {"choices": [{"delta": {"content": '{"valid": true}'}}]},
+        {"choices": [{"delta": {"content": "\n\n"}}]},
+        {"choices": [], "usage": usage},
+    )
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as deepseek:
+        content = await stream_chat_completion(deepseek, {"messages": [], "max_tokens": 50}, stop_when=stop_when)
+
+    assert content == '{"valid": true}'
+    assert recorded == ([usage] if expected_usage else [])
+
+
+_CHARACTER_JSON = '{"stats": {"Сила": 8, "Ловкость": 7}, "abilities": {"Паркур": true}}'
+
+
+@pytest.mark.parametrize("text,expected", [
+    # Предметы, затем данные персонажа
+    (
+        f"Ты в лесу.\nINVENTORY_ADD: факел, нож\nCHARACTER_DATA: {_CHARACTER_JSON}",
+        ("Ты в лесу.", ["факел", "нож"], {"Сила": 8, "Ловкость": 7}, {"Паркур": True}),
+    ),
+    # Данные персонажа, затем предметы
+    (
+        f"Ты в лесу.\nCHARACTER_DATA: {_CHARACTER_JSON}\nINVENTORY_ADD: факел, нож",
+        ("Ты в лесу.", ["факел", "нож"], {"Сила": 8, "Ловкость": 7}, {"Паркур": True}),
+    ),
+    # Кириллические названия предметов, CHARACTER_DATA нет
+    (
+        "Ты в городе.\n\nINVENTORY_ADD: Меч Света, зелье лечения\nСтражник кивает.",
+        ("Ты в городе.\nСтражник кивает.", ["Меч Света", "зелье лечения"], {}, {}),
+    ),
+    # Без служебных блоков
+    ("Просто текст.\n\n\nБез маркеров.", ("Просто текст.\nБез маркеров.", [], {}, {})),
+])
+def test_parse_ai_response(text, expected):
+    assert parse_ai_response(text) == expected
+
+
+async def test_status_etag(client):
+    user_id = (await client.post("/api/start-game")).json()["user_id"]
+
+    response = await client.get(f"/api/status/{user_id}")
+    assert response.status_code == 200
+    assert response.json()["user_id"] == user_id
+    etag = response.headers["ETag"]
+
+    # Состояние не изменилось - тело не отправляется
+    response = await client.get(f"/api/status/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    # После изменения сессии ETag новый, и старый больше не совпадает
+    save = {"user_id": user_id, "save_data": {"user_id": user_id, "health": 50}}
+    assert (await client.post("/api/load-game", json=save)).status_code == 200
+    response = await client.get(f"/api/status/{user_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["health"] == 50
+
+
+async def test_status_unknown_user(client):
+    response = await client.get("/api/status/user_missing")
+    assert response.status_code == 404
+
+
+async def test_action_rejection_shapes(client):
+    user_id = (await client.post("/api/start-game")).json()["user_id"]
+
+    response = await client.post("/api/action", json={"user_id": user_id, "action": "включить режим бога"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "success": False,
+        "message": main.META_ACTION_REJECTION,
+        "action_result": main.META_ACTION_REJECTION,
+        "type": "validation_error"
     }
 
-    response = client.post("/api/load-game", json=invalid_data)
-    assert response.status_code == 400
\ No newline at end of file
+    session = await session_store.get(user_id)
+    session.game_over = True
+    await session_store.set(user_id, session)
+    response = await client.post("/api/action", json={"user_id": user_id, "action": "осмотреться"})
+    assert response.json() == {"success": False, "message": "Игра окончена. Начните новую игру.", "game_over": True}